@@ -5,11 +5,18 @@ from PIL import Image, ImageTk
 import threading
 import os
 
+import tracing
 from pdf_engine import PDFEngine
+from context_compressor import format_stats
+from retrieval import BM25Index
+from doc_cache import open_session
 from llm_controller import LLMController
+from bib_client import RemoteController
+
+AUTO_MODEL_LABEL = "Auto (Tiered)"
 
 class BibApp:
-    def __init__(self, root):
+    def __init__(self, root, server_url=None):
         self.root = root
         self.root.title("PDF Bib Extractor (LLM-Only)")
         self.root.geometry("1400x900")
@@ -60,6 +67,9 @@ class BibApp:
         self.pdf_engine = PDFEngine()
         self.llm_controller = None
         self.current_context = "" # Holds text of last ~15 pages
+        self.context_narrowed = False # True once the bibliography section was located
+        self.retrieval_index = None # BM25 over document chunks, used when narrowing fails
+        self.doc_session = None # Per-document cache reused across revisions of the same paper
         
         self.current_page = 0
         self.image_ref = None # Keep reference to avoid GC
@@ -83,6 +93,23 @@ class BibApp:
         
         self._setup_ui()
 
+        # Thin-client mode: a local bib_server.py does extraction and LLM work
+        if server_url:
+            self._connect_to_server(server_url)
+
+    def _connect_to_server(self, server_url):
+        ctrl = RemoteController(server_url)
+        success, msg = ctrl.validate_connection()
+        if not success:
+            self._on_key_error(msg)
+            return
+        self.llm_controller = ctrl
+        self.btn_open.config(state="normal")
+        self.key_status_label.config(text=f"Connected (server {server_url})", foreground=self.colors["success"])
+        self.status_var.set("Ready. Using local server.")
+        for widget in self.key_container.winfo_children():
+            widget.destroy()
+
     def load_config(self):
         import json
         if os.path.exists(self.config_file):
@@ -95,9 +122,12 @@ class BibApp:
 
     def save_config(self, key):
         import json
+        # Merge so optional sections (e.g. "hedge") survive a key change
+        config = self.load_config()
+        config["api_key"] = key
         try:
             with open(self.config_file, "w") as f:
-                json.dump({"api_key": key}, f)
+                json.dump(config, f)
         except Exception as e:
             print(f"Failed to save config: {e}")
 
@@ -205,6 +235,15 @@ class BibApp:
                 try:
                     # Test connection via LLMController -> Helper
                     ctrl = LLMController(api_key=key)
+                    # Optional hedging: {"hedge": {"api_key": ..., "provider": ..., "model": ..., "percentile": 0.95}}
+                    hedge_cfg = self.load_config().get("hedge")
+                    if hedge_cfg and hedge_cfg.get("api_key"):
+                        ctrl.enable_hedging(
+                            hedge_cfg["api_key"],
+                            provider=hedge_cfg.get("provider", "auto"),
+                            model_name=hedge_cfg.get("model"),
+                            percentile=hedge_cfg.get("percentile", 0.95),
+                        )
                     # We access the helper directly for validation
                     success, msg = ctrl.llm.validate_connection()
                     result['res'] = (success, msg, ctrl)
@@ -245,6 +284,10 @@ class BibApp:
         # Get Available Models
         from llm_helper import LLMHelper
         models = LLMHelper.AVAILABLE_MODELS.get(provider, [current_model])
+        if provider in LLMHelper.MODEL_TIERS:
+            models = [AUTO_MODEL_LABEL] + models
+            if ctrl.routing:
+                current_model = AUTO_MODEL_LABEL
 
         self.key_status_label.config(text=f"Connected ({provider})", foreground=self.colors["success"])
         self.llm_controller = ctrl
@@ -273,7 +316,12 @@ class BibApp:
     def on_model_changed(self, event):
         if self.llm_controller:
             new_model = self.model_combo.get()
-            self.llm_controller.llm.set_model(new_model)
+            if new_model == AUTO_MODEL_LABEL:
+                self.llm_controller.routing = True
+            else:
+                # Pinning a model disables tier routing
+                self.llm_controller.routing = False
+                self.llm_controller.llm.set_model(new_model)
             self.status_var.set(f"Switched to {new_model}")
 
     def reset_api_ui(self):
@@ -290,6 +338,10 @@ class BibApp:
             self.root.update()
             try:
                 self.pdf_engine.load_pdf(path)
+                self.current_context = ""
+                self.context_narrowed = False
+                self.retrieval_index = None
+                self.doc_session = None
                 self.current_page = 0
                 self.fit_to_page()
                 self.update_page_label()
@@ -302,49 +354,104 @@ class BibApp:
                 self.status_var.set(f"Error loading PDF: {e}")
 
     def _fetch_context_thread(self):
+        if getattr(self.llm_controller, "is_remote", False):
+            self._fetch_remote_context()
+            return
         try:
+            # Seed text of pages unchanged since a previous revision, so only changed pages are extracted
+            session = None
+            try:
+                session = open_session(self.pdf_engine)
+                print(f"[DEBUG] Document cache: {len(session.changed_pages)}/{self.pdf_engine.get_page_count()} pages changed")
+            except Exception as e:
+                print(f"[WARN] Document cache unavailable: {e}")
+
             # Load FULL context, then ask the LLM to locate the bibliography range.
-            full_text = self.pdf_engine.get_context_text(page_count=None, force_full=True)
+            full_text = self.pdf_engine.get_context_text(page_count=None, force_full=True, compress=True, drop_captions=True)
             if not full_text:
                 self.update_status("Context Load Failed (Empty).")
                 return
 
+            if session:
+                session.update_page_texts(self.pdf_engine)
+                self.doc_session = session
+
+            stats = self.pdf_engine.last_compression_stats
+            if stats:
+                print(f"[DEBUG] Context compression: {format_stats(stats)}")
             self.update_status(f"Context Loaded ({len(full_text)} chars). Locating bibliography...")
             
             # DEFAULT to full text immediately, so we are robust against LLM failures
             self.current_context = full_text
+            # Local index for selections if no clean bibliography section is found
+            self.retrieval_index = BM25Index.from_context_text(full_text)
             
             try:
                 narrowed_context = ""
-                if self.llm_controller:
+                range_info = session.cached_range() if session else None
+                if range_info:
+                    print(f"[DEBUG] Reusing cached bibliography range {range_info['start_page']}-{range_info['end_page']}")
+                elif self.llm_controller:
                     range_info = self.llm_controller.resolve_bibliography_range(full_text)
-                    if range_info:
-                        start_page = range_info.get("start_page")
-                        end_page = range_info.get("end_page")
-                        if isinstance(start_page, int) and isinstance(end_page, int):
-                            narrowed_context = self.pdf_engine.get_context_text_range(start_page, end_page)
-
-                        if narrowed_context:
-                            self.current_context = narrowed_context
-                            self.update_status(f"Context narrowed to pages {start_page}-{end_page}. Ready.")
+                    if range_info and session:
+                        session.store_range(range_info)
+                if range_info:
+                    start_page = range_info.get("start_page")
+                    end_page = range_info.get("end_page")
+                    if isinstance(start_page, int) and isinstance(end_page, int):
+                        narrowed_context = self.pdf_engine.get_context_text_range(start_page, end_page, compress=True)
+
+                    if narrowed_context:
+                        self.current_context = narrowed_context
+                        self.context_narrowed = True
+                        self.update_status(f"Context narrowed to pages {start_page}-{end_page}. Ready.")
             except Exception as e:
                 print(f"[WARN] Bibliography narrowing failed: {e}")
                 self.update_status(f"Bibliography Auto-Locate Failed (Using Full Text).")
 
             # --- New: Detect Style from Page 1 ---
             self._detect_style_in_background()
+            if session:
+                session.save()
         except Exception as e:
             print(f"Context error: {e}")
             self.update_status("Context Load Failed (Check Console).")
 
+    def _fetch_remote_context(self):
+        """Thin-client variant: the server extracts, narrows and caches the document."""
+        try:
+            self.llm_controller.load_document(self.pdf_engine.path)
+            self.update_status("Registered with server. Locating bibliography...")
+            range_info = self.llm_controller.resolve_bibliography_range()
+            if range_info:
+                self.update_status(f"Context narrowed to pages {range_info['start_page']}-{range_info['end_page']}. Ready.")
+            else:
+                self.update_status("Bibliography Auto-Locate Failed (Using Full Text).")
+            style = self.llm_controller.detect_citation_style()
+            self.citation_style_hint = style
+            print(f"[DEBUG] Detected Citation Style: {style}")
+            self.update_status(f"{self.status_var.get()} [Style: {style}]")
+        except Exception as e:
+            print(f"Server context error: {e}")
+            self.update_status("Server Context Load Failed (Check Console).")
+
     def _detect_style_in_background(self):
         try:
             # Extract text from first few pages (up to 5) to find Main Text
             page_limit = min(5, self.pdf_engine.get_page_count())
-            first_pages_text = self.pdf_engine.get_context_text_range(1, page_limit) 
+            first_pages_text = self.pdf_engine.get_context_text_range(1, page_limit, compress=True)
             
-            if first_pages_text and self.llm_controller:
-                style = self.llm_controller.detect_citation_style(first_pages_text)
+            session = self.doc_session
+            cached_style = session.cached_style() if session else None
+            if cached_style:
+                self.citation_style_hint = cached_style
+                print(f"[DEBUG] Reusing cached citation style: {cached_style}")
+                self.update_status(f"{self.status_var.get()} [Style: {cached_style}]")
+            elif first_pages_text and self.llm_controller:
+                spans = self.pdf_engine.get_text_spans(1, page_limit)
+                style = self.llm_controller.detect_citation_style(first_pages_text, spans=spans)
+                if session and style:
+                    session.store_style(style)
                 self.citation_style_hint = style
                 # Update UI Status if possible, or log it
                 print(f"[DEBUG] Detected Citation Style: {style}")
@@ -386,14 +493,14 @@ class BibApp:
         self.fit_to_page()
 
     def fit_to_page(self):
-        if not self.pdf_engine.doc: return
+        if not self.pdf_engine.get_page_count(): return
         canvas_w = self.canvas.winfo_width()
         canvas_h = self.canvas.winfo_height()
         if canvas_w > 10 and canvas_h > 10:
             try:
-                page = self.pdf_engine.doc[self.current_page]
-                scale_w = (canvas_w - 20) / page.rect.width
-                scale_h = (canvas_h - 20) / page.rect.height
+                page_rect = self.pdf_engine.get_page_rect(self.current_page)
+                scale_w = (canvas_w - 20) / page_rect.width
+                scale_h = (canvas_h - 20) / page_rect.height
                 self.zoom_level = min(scale_w, scale_h)
                 if self.zoom_level < 0.1: self.zoom_level = 0.1
                 self.render_page()
@@ -431,35 +538,62 @@ class BibApp:
             y1 = (max(start_y, y) - offset_y) / self.zoom_level
             
             rect = fitz.Rect(x0, y0, x1, y1)
-            text = self.pdf_engine.get_text_in_rect(self.current_page, rect)
+            trace_id = tracing.start_trace("selection")
+            with tracing.activate(trace_id):
+                text = self.pdf_engine.get_text_in_rect(self.current_page, rect)
             
             if text and text.strip():
                 print(f"[DEBUG] User Selection: '{text}'")
                 self.status_var.set("Resolving selection with LLM...")
-                self._process_selection(text)
+                self._process_selection(text, trace_id)
             else:
                 self.status_var.set("Empty selection.")
+                tracing.end_trace(trace_id)
             
         self.canvas.delete("selection_box")
         self.selection_start = None
 
-    def _process_selection(self, text):
+    def _process_selection(self, text, trace_id=None):
         if not self.llm_controller:
+            tracing.end_trace(trace_id)
             return
 
         def task():
+            session = self.doc_session
+            style = self.citation_style_hint
             try:
+                cached = session.lookup(text, style) if session else None
+                if cached:
+                    # Resolved in an earlier revision and its source pages are unchanged
+                    self.append_to_output(cached + "\n\n", trace_id)
+                    self.update_status("Resolution Complete (Cached).")
+                    return
+
+                context = self.current_context
+                if not self.context_narrowed and self.retrieval_index:
+                    # No bibliography section: send only the top-k candidate snippets
+                    with tracing.activate(trace_id), tracing.span("retrieve"):
+                        context = self.retrieval_index.build_context(text) or context
                 # LLM Call
-                result = self.llm_controller.resolve_citation(
-                    text, 
-                    self.current_context, 
-                    style_hint=self.citation_style_hint
-                )
+                with tracing.activate(trace_id):
+                    result = self.llm_controller.resolve_citation(
+                        text, 
+                        context, 
+                        style_hint=style,
+                        progress=lambda done, total: self.update_status(f"Resolving selection... ({done}/{total} chunks)"),
+                    )
                 if result:
-                    self.append_to_output(str(result) + "\n\n")
+                    self.append_to_output(str(result) + "\n\n", trace_id)
                     self.update_status("Resolution Complete.")
+                    if session and "% [Error]" not in str(result):
+                        session.store(text, style, str(result), context)
+                        session.save()
+                    # Thin-client controllers have no local helper (hedging runs on the server)
+                    llm = getattr(self.llm_controller, "llm", None)
+                    if llm and llm.hedge_policy:
+                        print(f"[HEDGE] {llm.hedge_policy.summary()}")
                 else:
-                     self.append_to_output("% No result returned.\n\n")
+                     self.append_to_output("% No result returned.\n\n", trace_id)
                      self.update_status("Resolution Complete (Empty).")
             except Exception as e:
                 err_str = str(e).lower()
@@ -468,17 +602,20 @@ class BibApp:
                 else:
                     msg = f"% [Error] {e}"
                 
-                self.append_to_output(msg + "\n\n")
+                self.append_to_output(msg + "\n\n", trace_id)
                 self.update_status("Error: Rate Limit Exceeded" if "rate limit" in err_str or "429" in err_str else f"Error: {e}")
 
         threading.Thread(target=task).start()
 
-    def append_to_output(self, text):
-        self.root.after_idle(lambda: self._insert_text(text))
+    def append_to_output(self, text, trace_id=None):
+        self.root.after_idle(lambda: self._insert_text(text, trace_id))
 
-    def _insert_text(self, text):
-        self.output_text.insert(tk.END, text)
-        self.output_text.see(tk.END)
+    def _insert_text(self, text, trace_id=None):
+        with tracing.span("tk_insert", trace_id=trace_id):
+            self.output_text.insert(tk.END, text)
+            self.output_text.see(tk.END)
+        # Insertion is the last stage of a selection, so the trace is complete here
+        tracing.end_trace(trace_id)
 
     def update_status(self, text):
         self.root.after_idle(lambda: self.status_var.set(text))
@@ -505,6 +642,12 @@ class BibApp:
         except tk.TclError: pass
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="PDF Bib Extractor")
+    parser.add_argument("--server", default=os.getenv("BIB_SERVER_URL"),
+                        help="Use a running bib_server.py (e.g. http://127.0.0.1:8765) as a thin client.")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = BibApp(root)
+    app = BibApp(root, server_url=args.server)
     root.mainloop()
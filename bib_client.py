@@ -0,0 +1,58 @@
+import json
+import urllib.request
+import urllib.error
+
+
+class RemoteController:
+    """
+    Thin client for bib_server.py with the same task methods as LLMController.
+    The server owns the document text, so the text arguments are accepted for
+    interface compatibility but not sent; call load_document() first.
+    """
+    is_remote = True
+
+    def __init__(self, base_url, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.doc_id = None
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(
+            self.base_url + path, data=data, method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            try:
+                msg = json.loads(e.read()).get("error", str(e))
+            except ValueError:
+                msg = str(e)
+            raise RuntimeError(f"Server error ({e.code}): {msg}")
+
+    def validate_connection(self):
+        try:
+            stats = self._request("GET", "/health")
+            return True, f"Success: Server Connected ({stats.get('documents', 0)} documents cached)."
+        except Exception as e:
+            return False, f"Connection Failed: {str(e)}"
+
+    def load_document(self, path):
+        """Registers a local PDF path with the server; returns the page count."""
+        result = self._request("POST", "/documents", {"path": path})
+        self.doc_id = result["doc_id"]
+        return result["page_count"]
+
+    def resolve_bibliography_range(self, full_text=None):
+        return self._request("GET", f"/documents/{self.doc_id}/range")
+
+    def detect_citation_style(self, first_pages_text=None, spans=None):
+        return self._request("GET", f"/documents/{self.doc_id}/style").get("style", "")
+
+    def resolve_citation(self, selection_text, context_text=None, style_hint=None, progress=None):
+        return self._request("POST", f"/documents/{self.doc_id}/resolve", {"selection": selection_text}).get("bibtex")
+
+    def extract_all(self):
+        return self._request("POST", f"/documents/{self.doc_id}/extract").get("bibtex")
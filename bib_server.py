@@ -0,0 +1,298 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tracing
+from pdf_engine import PDFEngine
+from llm_controller import LLMController
+from retrieval import BM25Index
+
+# Local JSON service: one warm process shares document/response caches and a
+# bounded worker pool between the GUI (thin-client mode) and scripts.
+#
+#   POST /documents                    {"path": ...} or {"pdf_base64": ...} -> {"doc_id", "page_count"}
+#   GET  /documents/<doc_id>/range     -> {"start_page", "end_page", "reason"} or null
+#   GET  /documents/<doc_id>/style     -> {"style"}
+#   GET  /documents/<doc_id>/compression -> context compression stats (chars/tokens before/after)
+#   POST /documents/<doc_id>/resolve   {"selection": ...} -> {"bibtex"}
+#   POST /documents/<doc_id>/extract   -> {"bibtex"} for the whole bibliography
+#   GET  /health                       -> {"status", "documents", "cached_responses"}
+
+DEFAULT_PORT = 8765
+
+
+class ResponseCache:
+    """Thread-safe LRU cache for resolved selections."""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class BibService:
+    """
+    Shared state behind the HTTP server.
+    Documents are keyed by the SHA-256 of their bytes, so the same PDF registered
+    by different clients (or paths) is extracted and analysed only once.
+    """
+
+    def __init__(self, controller, max_workers=4):
+        self.controller = controller
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bib-worker")
+        self.responses = ResponseCache()
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def register(self, pdf_bytes, path=None):
+        doc_id = hashlib.sha256(pdf_bytes).hexdigest()[:16]
+        with self._lock:
+            if doc_id in self._docs:
+                return doc_id, self._docs[doc_id]["engine"].get_page_count()
+            if not path:
+                cache_dir = os.path.join(os.path.expanduser("~"), ".bib_extractor_cache")
+                os.makedirs(cache_dir, exist_ok=True)
+                path = os.path.join(cache_dir, f"{doc_id}.pdf")
+                with open(path, "wb") as f:
+                    f.write(pdf_bytes)
+            engine = PDFEngine()
+            engine.load_pdf(path)
+            self._docs[doc_id] = {
+                "engine": engine,
+                "lock": threading.Lock(),  # serialises one-off analysis per document
+                "full_text": None,
+                "range": None,
+                "context": None,
+                "style": None,
+                "compression": None,
+                "index": None,
+            }
+        return doc_id, engine.get_page_count()
+
+    def _doc(self, doc_id):
+        with self._lock:
+            doc = self._docs.get(doc_id)
+        if doc is None:
+            raise KeyError(f"Unknown document: {doc_id}")
+        return doc
+
+    def get_range(self, doc_id):
+        """Locates the bibliography once per document; later calls hit the cache."""
+        doc = self._doc(doc_id)
+        with doc["lock"]:
+            if doc["context"] is None:
+                engine = doc["engine"]
+                doc["full_text"] = engine.get_context_text(page_count=None, force_full=True, compress=True, drop_captions=True)
+                doc["compression"] = engine.last_compression_stats
+                doc["context"] = doc["full_text"]
+                doc["index"] = BM25Index.from_context_text(doc["full_text"])
+                try:
+                    range_info = self.controller.resolve_bibliography_range(doc["full_text"])
+                except Exception as e:
+                    print(f"[WARN] Bibliography narrowing failed: {e}")
+                    range_info = None
+                if range_info:
+                    narrowed = engine.get_context_text_range(range_info["start_page"], range_info["end_page"], compress=True)
+                    if narrowed:
+                        doc["context"] = narrowed
+                        doc["range"] = range_info
+            return doc["range"]
+
+    def get_compression(self, doc_id):
+        self.get_range(doc_id)
+        return self._doc(doc_id)["compression"]
+
+    def get_style(self, doc_id):
+        doc = self._doc(doc_id)
+        with doc["lock"]:
+            if doc["style"] is None:
+                engine = doc["engine"]
+                page_limit = min(5, engine.get_page_count())
+                first_pages_text = engine.get_context_text_range(1, page_limit, compress=True)
+                spans = engine.get_text_spans(1, page_limit)
+                doc["style"] = self.controller.detect_citation_style(first_pages_text, spans=spans) if first_pages_text else ""
+            return doc["style"]
+
+    def resolve(self, doc_id, selection, context=None):
+        """context=None uses the document's bibliography (or retrieved snippets)."""
+        self.get_range(doc_id)
+        style = self.get_style(doc_id)
+        key = (doc_id, re.sub(r"\s+", " ", selection).strip(), style)
+        cached = self.responses.get(key)
+        if cached is not None:
+            return cached
+        doc = self._doc(doc_id)
+        use_doc_context = context is None
+        if use_doc_context:
+            context = doc["context"]
+        trace_id = tracing.start_trace("resolve")
+        try:
+            with tracing.activate(trace_id):
+                if use_doc_context and doc["range"] is None and doc["index"] is not None:
+                    # No bibliography section: send only the top-k candidate snippets
+                    with tracing.span("retrieve"):
+                        context = doc["index"].build_context(selection) or context
+                result = self.controller.resolve_citation(selection, context, style_hint=style)
+        finally:
+            tracing.end_trace(trace_id)
+        if result:
+            self.responses.put(key, result)
+        return result
+
+    def extract(self, doc_id):
+        """Resolves every entry of the bibliography section."""
+        self.get_range(doc_id)
+        doc = self._doc(doc_id)
+        if doc["range"] is None:
+            raise ValueError("No bibliography section found; select references manually.")
+        # The selection already is the bibliography; don't send it a second time as context
+        return self.resolve(doc_id, doc["context"], context="")
+
+    def stats(self):
+        with self._lock:
+            documents = len(self._docs)
+        return {"status": "ok", "documents": documents, "cached_responses": len(self.responses)}
+
+
+class BibRequestHandler(BaseHTTPRequestHandler):
+    server_version = "BibServer/1.0"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _run(self, fn, *args):
+        """Runs work on the shared bounded pool and replies with its result."""
+        try:
+            result = self.server.service.executor.submit(fn, *args).result()
+            self._send_json(200, result)
+        except KeyError as e:
+            self._send_json(404, {"error": e.args[0] if e.args else str(e)})
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def do_GET(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        if parts == ["health"]:
+            self._send_json(200, service.stats())
+        elif len(parts) == 3 and parts[0] == "documents" and parts[2] == "range":
+            self._run(service.get_range, parts[1])
+        elif len(parts) == 3 and parts[0] == "documents" and parts[2] == "compression":
+            self._run(service.get_compression, parts[1])
+        elif len(parts) == 3 and parts[0] == "documents" and parts[2] == "style":
+            self._run(lambda doc_id: {"style": service.get_style(doc_id)}, parts[1])
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        parts = self.path.strip("/").split("/")
+        try:
+            payload = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": "Invalid JSON body."})
+            return
+
+        if parts == ["documents"]:
+            def register():
+                if payload.get("path"):
+                    with open(payload["path"], "rb") as f:
+                        doc_id, page_count = service.register(f.read(), path=payload["path"])
+                elif payload.get("pdf_base64"):
+                    doc_id, page_count = service.register(base64.b64decode(payload["pdf_base64"]))
+                else:
+                    raise ValueError("Provide 'path' or 'pdf_base64'.")
+                return {"doc_id": doc_id, "page_count": page_count}
+            self._run(register)
+        elif len(parts) == 3 and parts[0] == "documents" and parts[2] == "resolve":
+            selection = payload.get("selection", "")
+            if not selection.strip():
+                self._send_json(400, {"error": "Empty selection."})
+                return
+            self._run(lambda doc_id: {"bibtex": service.resolve(doc_id, selection)}, parts[1])
+        elif len(parts) == 3 and parts[0] == "documents" and parts[2] == "extract":
+            self._run(lambda doc_id: {"bibtex": service.extract(doc_id)}, parts[1])
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+
+    def log_message(self, format, *args):
+        print(f"[SERVER] {self.address_string()} {format % args}")
+
+
+def _load_api_key():
+    key = os.getenv("GOOGLE_API_KEY") or os.getenv("OPENAI_API_KEY")
+    if key:
+        return key
+    config_file = os.path.join(os.path.expanduser("~"), ".bib_extractor_config.json")
+    if os.path.exists(config_file):
+        try:
+            with open(config_file, "r") as f:
+                return json.load(f).get("api_key")
+        except Exception:
+            pass
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local BibTeX extraction service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=4, help="Maximum concurrent extraction/LLM jobs.")
+    args = parser.parse_args()
+
+    api_key = _load_api_key()
+    if not api_key:
+        raise SystemExit("No API key found (set GOOGLE_API_KEY/OPENAI_API_KEY or run bib_app.py once).")
+
+    service = BibService(LLMController(api_key=api_key), max_workers=args.workers)
+    httpd = ThreadingHTTPServer((args.host, args.port), BibRequestHandler)
+    httpd.service = service
+    print(f"Serving on http://{args.host}:{args.port} ({args.workers} workers)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import re
+from collections import Counter
+
+# Optional exact token counts; falls back to a ~4 chars/token estimate.
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+    HAS_TIKTOKEN = True
+except Exception:
+    HAS_TIKTOKEN = False
+
+# Strips page furniture from extracted PDF text before it is sent to the LLM:
+# running headers/footers, page numbers, line-break hyphenation, ligatures,
+# blank runs and (optionally) figure/table captions outside the bibliography.
+# Page markers are kept so page numbers in the compressed text still map to the PDF.
+
+LIGATURES = {
+    "ﬀ": "ff", "ﬁ": "fi", "ﬂ": "fl", "ﬃ": "ffi",
+    "ﬄ": "ffl", "ﬅ": "st", "ﬆ": "st", "­": "",
+}
+LIGATURE_RE = re.compile("|".join(LIGATURES))
+
+PAGE_NUMBER_RE = re.compile(r"^(?:page\s+)?(?:\d{1,4}|[ivxlc]{1,6})(?:\s*(?:of|/)\s*\d{1,4})?$", re.IGNORECASE)
+CAPTION_RE = re.compile(r"^(?:Figure|Fig\.|Table|FIG\.|TABLE)\s*[A-Z]?\d+[.:|]")
+# A heading alone on its line (a ToC entry "References ..... 42" doesn't match)
+BIBLIOGRAPHY_HEADING_RE = re.compile(
+    r"^\s*(?:[\dIVX]+\.?\s+)?(?:References|REFERENCES|Bibliography|BIBLIOGRAPHY|Literature Cited|Works Cited)\s*$",
+    re.MULTILINE,
+)
+
+# Headers/footers only live in the first/last few lines of a page
+EDGE_LINES = 3
+
+
+def estimate_tokens(text):
+    if HAS_TIKTOKEN:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _furniture_key(line):
+    # Digits vary between pages ("Page 3", "J. Phys. 12 (2020) 345"), so ignore them
+    return re.sub(r"\d+", "#", line.strip().lower())
+
+
+def find_furniture(page_texts):
+    """
+    Returns normalised keys of header/footer lines repeated across pages.
+    page_texts: list of raw page strings for the whole document.
+    """
+    if len(page_texts) < 3:
+        return set()
+    counts = Counter()
+    for text in page_texts:
+        lines = [l for l in text.splitlines() if l.strip()]
+        edges = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        counts.update({_furniture_key(l) for l in edges if len(l.strip()) < 120})
+    threshold = max(3, len(page_texts) // 2)
+    return {key for key, n in counts.items() if n >= threshold}
+
+
+def normalize_page(text, furniture=frozenset(), drop_captions=False):
+    """Cleans one page of extracted text."""
+    text = LIGATURE_RE.sub(lambda m: LIGATURES[m.group(0)], text)
+    lines = [l.strip() for l in text.splitlines()]
+    non_empty = [i for i, l in enumerate(lines) if l]
+    edges = set(non_empty[:EDGE_LINES] + non_empty[-EDGE_LINES:])
+
+    kept = []
+    in_caption = 0
+    for i, line in enumerate(lines):
+        if not line:
+            continue
+        if i in edges and (PAGE_NUMBER_RE.match(line) or _furniture_key(line) in furniture):
+            continue
+        if drop_captions:
+            if CAPTION_RE.match(line):
+                in_caption = 6  # captions rarely run longer than this
+            if in_caption:
+                in_caption = 0 if line.endswith(".") else in_caption - 1
+                continue
+        kept.append(line)
+
+    out = ""
+    for line in kept:
+        if out.endswith("-") and line[:1].islower() and out[-2:-1].isalpha():
+            out = out[:-1] + line  # de-hyphenate "refer-\nences"
+        elif out:
+            out += "\n" + line
+        else:
+            out = line
+    return re.sub(r"[ \t]+", " ", out)
+
+
+def compress_pages(pages, furniture=frozenset(), drop_captions=False):
+    """
+    pages: list of (page_number, raw_text) with 1-based page numbers.
+    Returns (text, stats) where text keeps the "--- Page N ---" markers and stats
+    reports characters and tokens before/after.
+    drop_captions stops at the first bibliography heading: from that page on,
+    caption-like lines may be reference text and are kept.
+    """
+    raw = ""
+    compressed = ""
+    for page_num, text in pages:
+        if drop_captions and BIBLIOGRAPHY_HEADING_RE.search(text):
+            drop_captions = False
+        marker = f"\n--- Page {page_num} ---\n"
+        raw += marker + text
+        compressed += marker + normalize_page(text, furniture, drop_captions) + "\n"
+
+    raw_tokens = estimate_tokens(raw)
+    compressed_tokens = estimate_tokens(compressed)
+    stats = {
+        "chars_before": len(raw),
+        "chars_after": len(compressed),
+        "tokens_before": raw_tokens,
+        "tokens_after": compressed_tokens,
+        "token_reduction": 1 - compressed_tokens / raw_tokens if raw_tokens else 0.0,
+    }
+    return compressed, stats
+
+
+def format_stats(stats):
+    return (f"{stats['chars_before']} -> {stats['chars_after']} chars, "
+            f"~{stats['tokens_before']} -> {stats['tokens_after']} tokens "
+            f"(-{stats['token_reduction']:.0%})")
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+# Persistent per-document cache keyed by document identity (arXiv ID or path),
+# so a new revision of a paper reuses work from the previous one:
+#   - page text is re-extracted only for pages whose content changed
+#   - the bibliography range is reused (and shifted) if its pages are unchanged
+#   - the citation style is reused if the first pages are unchanged
+#   - resolved selections from an earlier revision are reused if every page they
+#     drew context from is unchanged (within one revision a re-selection resolves afresh)
+# Pages are matched to the previous revision by PDFEngine.get_page_content_hashes
+# (content streams plus fully resolved resources, so text drawn through form
+# XObjects counts); range, style and selections are then keyed on hashes of
+# the pages' extracted text.
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".bib_extractor_cache", "documents")
+ARXIV_ID_RE = re.compile(r"(\d{4}\.\d{4,5})(?:v\d+)?")
+PAGE_MARKER_RE = re.compile(r"--- Page (\d+) ---")
+BIBTEX_ENTRY_RE = re.compile(r"@\w+\s*\{")
+STYLE_PAGES = 5
+
+
+def _sha1(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def document_key(path):
+    """Revisions share a key: the arXiv ID without version if the filename has one, else the path."""
+    m = ARXIV_ID_RE.search(os.path.basename(path))
+    if m:
+        return f"arxiv:{m.group(1)}"
+    return f"path:{os.path.abspath(path)}"
+
+
+def _selection_key(selection, style):
+    normalized = re.sub(r"\s+", " ", selection).strip()
+    return _sha1(f"{style or ''}\n{normalized}")
+
+
+class DocumentSession:
+    """Cache state for one opened document. Thread-safe; save() persists it."""
+
+    def __init__(self, path, record, content_hashes):
+        self.path = path
+        self.record = record
+        self.content_hashes = content_hashes
+        self.revision = _sha1("".join(content_hashes))
+        self.text_hashes = [None] * len(content_hashes)
+        self.changed_pages = []
+        self._lock = threading.Lock()
+
+    def restore_page_texts(self, engine):
+        """Seeds the engine with cached text for pages whose content is unchanged."""
+        texts = self.record.get("texts", {})
+        old_pages = self.record.get("pages", [])
+        old_by_content = {p["content"]: p["text"] for p in old_pages}
+        seeded = {}
+        for i, content_hash in enumerate(self.content_hashes):
+            text_hash = old_by_content.get(content_hash)
+            if text_hash is not None and text_hash in texts:
+                seeded[i] = texts[text_hash]
+                self.text_hashes[i] = text_hash
+            else:
+                self.changed_pages.append(i)
+        engine.seed_page_texts(seeded)
+        return seeded
+
+    def update_page_texts(self, engine):
+        """Hashes the (now extracted) text of every page and stores it for the next revision."""
+        with self._lock:
+            texts = {}
+            for i in range(len(self.content_hashes)):
+                text = engine.get_page_text(i)
+                self.text_hashes[i] = _sha1(text)
+                texts[self.text_hashes[i]] = text
+            self.record["pages"] = [
+                {"content": c, "text": t} for c, t in zip(self.content_hashes, self.text_hashes)
+            ]
+            self.record["texts"] = texts
+
+    def _pages_hashes(self, page_numbers):
+        return [self.text_hashes[p - 1] for p in page_numbers if 0 < p <= len(self.text_hashes)]
+
+    def cached_range(self):
+        """Previous bibliography range if its pages are unchanged, shifted to their new position."""
+        cached = self.record.get("range")
+        if not cached:
+            return None
+        old_hashes = cached["hashes"]
+        n = len(old_hashes)
+        if n == 0:
+            return None
+        for start in range(len(self.text_hashes) - n + 1):
+            if self.text_hashes[start:start + n] == old_hashes:
+                return {"start_page": start + 1, "end_page": start + n, "reason": (cached.get("reason", "") + " (cached)").strip()}
+        return None
+
+    def store_range(self, range_info):
+        """Remembers a range; ranges reaching outside the document are not cached."""
+        pages = range(range_info["start_page"], range_info["end_page"] + 1)
+        hashes = self._pages_hashes(pages)
+        if not hashes or len(hashes) < len(pages):
+            return
+        with self._lock:
+            self.record["range"] = {"hashes": hashes, "reason": range_info.get("reason", "")}
+
+    def cached_style(self):
+        cached = self.record.get("style")
+        if cached and cached["hashes"] == self.text_hashes[:STYLE_PAGES]:
+            return cached["label"]
+        return None
+
+    def store_style(self, label):
+        with self._lock:
+            self.record["style"] = {"label": label, "hashes": self.text_hashes[:STYLE_PAGES]}
+
+    def lookup(self, selection, style):
+        """
+        BibTeX resolved for this selection in an earlier revision, if its source pages
+        are unchanged. Entries from the current revision are not returned, so
+        re-selecting the same text asks again (and replaces a wrong answer).
+        """
+        entry = self.record.get("entries", {}).get(_selection_key(selection, style))
+        if entry and entry.get("revision") != self.revision and set(entry["hashes"]) <= set(self.text_hashes):
+            return entry["bibtex"]
+        return None
+
+    def store(self, selection, style, bibtex, context_text):
+        """Remembers a resolution together with the pages its context came from."""
+        if not BIBTEX_ENTRY_RE.search(bibtex):
+            return  # e.g. the no-handles message: not worth replaying
+        pages = [int(p) for p in PAGE_MARKER_RE.findall(context_text or "")]
+        with self._lock:
+            self.record.setdefault("entries", {})[_selection_key(selection, style)] = {
+                "bibtex": bibtex,
+                "hashes": sorted(set(self._pages_hashes(pages))),
+                "revision": self.revision,
+            }
+
+    def save(self):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, f"{_sha1(self.record['key'])}.json")
+        with self._lock:
+            # Write-then-rename so a crash never leaves a truncated cache file
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.record, f)
+            os.replace(tmp, path)
+
+
+def open_session(engine):
+    """Loads the cache record for the engine's current document and seeds unchanged pages."""
+    key = document_key(engine.path)
+    record = {"key": key}
+    path = os.path.join(CACHE_DIR, f"{_sha1(key)}.json")
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                record = json.load(f)
+        except Exception as e:
+            print(f"[WARN] Ignoring unreadable document cache {path}: {e}")
+    session = DocumentSession(engine.path, record, engine.get_page_content_hashes())
+    session.restore_page_texts(engine)
+    return session
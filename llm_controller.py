@@ -1,10 +1,138 @@
+import contextvars
 import json
 import re
-from llm_helper import LLMHelper
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tracing
+from llm_helper import LLMHelper, HedgePolicy
+from style_classifier import classify_citation_style
+from reference_parser import split_entries, index_entries, parse_reference, to_bibtex, YEAR_RE
+
+NO_HANDLES_MSG = "% No valid citation handles found in selection."
+
+STYLE_LABELS = ["Numeric Brackets", "Author-Year", "Superscript", "Alpha-Numeric", "Footnotes", "Unknown/Generic"]
+
+BIBTEX_ENTRY_RE = re.compile(r'@\w+\s*\{')
+RANGE_SEPARATORS = re.escape("-–—‑−﹣－")
+
+
+def _numeric_handles(selection_text):
+    """
+    Expands bracketed numeric handles in a selection, e.g. "[1-3, 7]" -> [1, 2, 3, 7].
+    Used to check that a resolution covers every handle the user selected.
+    """
+    handles = []
+    for group in re.findall(r'\[([\d\s,;' + RANGE_SEPARATORS + r']+)\]', selection_text):
+        # Extraction can leave stray spaces ("[1 2]", "[3 - 5]"): attach them to ranges, split on the rest
+        group = re.sub(r'\s*([' + RANGE_SEPARATORS + r'])\s*', r'\1', group)
+        for part in re.split(r'[,;\s]+', group):
+            bounds = [b for b in re.split('[' + RANGE_SEPARATORS + r']', part) if b]
+            if not all(b.isdigit() for b in bounds):
+                continue
+            if len(bounds) == 2:
+                lo, hi = int(bounds[0]), int(bounds[1])
+                if 0 <= hi - lo <= 200:
+                    handles.extend(range(lo, hi + 1))
+            elif len(bounds) == 1:
+                handles.append(int(bounds[0]))
+    return list(dict.fromkeys(handles))
+
 
 class LLMController:
-    def __init__(self, api_key, provider="auto"):
+    # Starting tier (index into LLMHelper.MODEL_TIERS) per task.
+    # Every task starts on the fast model so invalid output (bad JSON, no BibTeX
+    # entries, missing handles) has a stronger tier to escalate to.
+    TASK_ROUTES = {
+        "resolve_bibliography_range": 0,
+        "detect_citation_style": 0,
+        "resolve_citation": 0,
+    }
+
+    # Local parses at or above this confidence are returned without an LLM call.
+    LOCAL_PARSE_THRESHOLD = 0.9
+
+    # Bibliography selections with at least this many entries are split into
+    # chunks that are resolved concurrently under the helper's rate limiter.
+    FANOUT_MIN_ENTRIES = 8
+    FANOUT_CHUNK_SIZE = 8
+    FANOUT_RETRIES = 2
+
+    # Local style classifications at or above this confidence skip the LLM call.
+    STYLE_CONFIDENCE_THRESHOLD = 0.75
+
+    def __init__(self, api_key, provider="auto", routing=True):
         self.llm = LLMHelper(api_key=api_key, provider=provider)
+        # When False, every task uses the helper's active model (e.g. pinned from the GUI dropdown).
+        self.routing = routing
+        self.routes = dict(self.TASK_ROUTES)
+
+    def enable_hedging(self, api_key, provider="auto", model_name=None, percentile=0.95, initial_delay=8.0):
+        """
+        Hedges slow calls to a secondary provider/model.
+        Hedge statistics are available via self.llm.hedge_policy.summary().
+        """
+        secondary = LLMHelper(api_key=api_key, provider=provider, model_name=model_name)
+        if not secondary.is_configured:
+            return None
+        policy = HedgePolicy(secondary, percentile=percentile, initial_delay=initial_delay)
+        self.llm.set_hedge_policy(policy)
+        return policy
+
+    def _tiers_for(self, task):
+        """Returns the models to try for a task, starting tier first."""
+        tiers = LLMHelper.MODEL_TIERS.get(self.llm.provider)
+        if not self.routing or not tiers:
+            return [self.llm.model_name]
+        start = min(self.routes.get(task, len(tiers) - 1), len(tiers) - 1)
+        return tiers[start:]
+
+    def _routed_query(self, task, prompt, validate, json_mode=False, temperature=0):
+        """
+        Runs a prompt on the task's tier and escalates to the next tier only when
+        validate(raw) rejects the output. Returns the last output if no tier passes.
+        """
+        tiers = self._tiers_for(task)
+        raw = None
+        for i, model_name in enumerate(tiers):
+            raw = self.llm.custom_query(
+                prompt, json_mode=json_mode, temperature=temperature, model_name=model_name,
+                validator=validate, task=task,
+            )
+            if validate(raw):
+                return raw
+            if i + 1 < len(tiers):
+                print(f"[INFO] {task}: invalid output from {model_name}, escalating to {tiers[i + 1]}")
+        return raw
+
+    @staticmethod
+    def _is_valid_json(raw):
+        if not raw:
+            return False
+        try:
+            json.loads(raw)
+            return True
+        except ValueError:
+            return False
+
+    @staticmethod
+    def _is_valid_style(raw):
+        return bool(raw) and any(label.lower() in raw.lower() for label in STYLE_LABELS)
+
+    @staticmethod
+    def _is_valid_bibtex(raw, selection_text, resolved_handles=()):
+        """
+        Output must contain BibTeX entries (or the explicit no-handles message) covering
+        every numeric handle not already in resolved_handles.
+        """
+        if not raw:
+            return False
+        if NO_HANDLES_MSG in raw:
+            return True
+        entries = BIBTEX_ENTRY_RE.findall(raw)
+        if not entries:
+            return False
+        return len(entries) >= len(set(_numeric_handles(selection_text)) - set(resolved_handles))
 
     def resolve_bibliography_range(self, full_text):
         """
@@ -47,7 +175,12 @@ class LLMController:
         \"\"\"{full_text}\"\"\"
         """
 
-        raw = self.llm.custom_query(prompt, json_mode=True, temperature=0)
+        raw = self._routed_query("resolve_bibliography_range", prompt, self._is_valid_json, json_mode=True, temperature=0)
+        return self._parse_range(raw)
+
+    @staticmethod
+    def _parse_range(raw):
+        """Parses the range answer, falling back to regex when the JSON is malformed."""
         if not raw:
             return None
         try:
@@ -78,10 +211,18 @@ class LLMController:
                 }
         return None
 
-    def detect_citation_style(self, first_pages_text):
+    def detect_citation_style(self, first_pages_text, spans=None):
         """
         Analyzes the first few pages (text) to identify the citation style used in the MAIN BODY.
+        The local classifier answers first (spans enable superscript detection);
+        the LLM is only asked when it is unsure.
         """
+        label, confidence = classify_citation_style(first_pages_text, spans)
+        if confidence >= self.STYLE_CONFIDENCE_THRESHOLD:
+            print(f"[DEBUG] Local style classifier: {label} ({confidence:.2f})")
+            return label
+        print(f"[DEBUG] Local style classifier unsure ({label}, {confidence:.2f}); asking LLM")
+
         prompt = f"""
         You are an expert at analyzing academic documents.
         
@@ -107,15 +248,136 @@ class LLMController:
         Return ONLY a short description string of the style. Do not explain.
         Example: "Numeric Brackets"
         """
-        return self.llm.custom_query(prompt).strip()
+        style = self._routed_query("detect_citation_style", prompt, self._is_valid_style)
+        return style.strip() if style else ""
+
+    def _resolve_locally(self, selection_text, context_text):
+        """
+        Resolves what the rule-based parser can handle with high confidence.
+        Returns (bibtex_entries, remaining_selection, resolved_handles): remaining_selection
+        is what still needs the LLM (None if everything was resolved locally), and
+        resolved_handles lists the numeric handles of the selection already covered.
+        """
+        local = []
+        entries = split_entries(selection_text)
+        handles = _numeric_handles(selection_text)
+        # A selection that carries its own labelled reference text is a list, not handles
+        is_list = any(e["label"] is not None and len(e["text"]) > 30 for e in entries)
+        if handles and context_text and not is_list:
+            # Numeric handles: look each one up in the labelled bibliography
+            indexed = index_entries(context_text)
+            resolved = []
+            for handle in handles:
+                parsed = parse_reference(indexed[handle]) if handle in indexed else None
+                if parsed and parsed["confidence"] >= self.LOCAL_PARSE_THRESHOLD:
+                    local.append(to_bibtex(parsed))
+                    resolved.append(handle)
+            # The LLM still sees the user's selection as is, told which handles to skip
+            return local, (selection_text if len(resolved) < len(handles) else None), resolved
+
+        # Bibliography list selection: parse each entry, forward the low-confidence ones unchanged
+        remaining = []
+        for entry in entries:
+            parsed = parse_reference(entry["text"])
+            if parsed["confidence"] >= self.LOCAL_PARSE_THRESHOLD:
+                local.append(to_bibtex(parsed))
+            else:
+                remaining.append(entry["raw"])
+        if not local:
+            return [], selection_text, []
+        return local, "\n".join(remaining) if remaining else None, []
+
+    def resolve_citation(self, selection_text, context_text, style_hint=None, progress=None):
+        """
+        Analyzes the user's selection and the document context to return BibTeX entries.
+        Entries the local parser resolves confidently skip the LLM entirely.
+        Large bibliography selections are fanned out in chunks; progress(done, total)
+        is called as chunks finish.
+        """
+        chunks = self._split_into_chunks(selection_text)
+        if len(chunks) > 1:
+            return self._resolve_fanout(chunks, style_hint, progress)
+        return self._resolve_single(selection_text, context_text, style_hint)
 
-    def resolve_citation(self, selection_text, context_text, style_hint=None):
+    def _split_into_chunks(self, selection_text):
+        """Returns the selection as chunks of reference entries, or [selection_text] if it isn't a big list."""
+        entries = split_entries(selection_text)
+        # A reference-like entry has a year or a list label plus enough text to be a reference
+        reference_like = sum(
+            1 for e in entries
+            if len(e["text"]) > 30 and (e["label"] is not None or YEAR_RE.search(e["text"]))
+        )
+        if reference_like < self.FANOUT_MIN_ENTRIES:
+            return [selection_text]
+        # Entries keep their original text and labels, so each chunk is parsed as a list
+        size = self.FANOUT_CHUNK_SIZE
+        return ["\n".join(e["raw"] for e in entries[i:i + size]) for i in range(0, len(entries), size)]
+
+    def _resolve_fanout(self, chunks, style_hint, progress=None):
         """
-        Analyzes the user's selection and the document context to return a BibTeX entry.
+        Resolves chunks concurrently and merges the results in original order.
+        Each chunk already holds its reference text, so the bibliography context
+        isn't sent again with every chunk.
         """
+        results = [None] * len(chunks)
+        workers = min(len(chunks), self.llm.rate_limiter.max_concurrent)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bib-chunk") as pool:
+            futures = {
+                # copy_context() keeps chunk spans under the caller's trace
+                pool.submit(contextvars.copy_context().run, self._resolve_chunk, chunk, style_hint): idx
+                for idx, chunk in enumerate(chunks)
+            }
+            for done, fut in enumerate(as_completed(futures), 1):
+                results[futures[fut]] = fut.result()
+                if progress:
+                    progress(done, len(chunks))
+        return "\n\n".join(r for r in results if r)
+
+    def _resolve_chunk(self, chunk, style_hint):
+        """Resolves one chunk, retrying it on its own if it errors or returns no entries."""
+        last_error = None
+        for attempt in range(self.FANOUT_RETRIES + 1):
+            if attempt:
+                time.sleep(2 ** attempt)  # back off, mostly for rate limits
+            try:
+                with tracing.span("resolve_chunk", attempt=attempt):
+                    result = self._resolve_single(chunk, "", style_hint)
+                if result and BIBTEX_ENTRY_RE.search(result):
+                    return result
+                last_error = "no BibTeX entries returned"
+            except Exception as e:
+                last_error = str(e)
+        first_line = chunk.splitlines()[0][:60]
+        return f"% [Error] Chunk starting '{first_line}' failed after {self.FANOUT_RETRIES + 1} attempts: {last_error}"
+
+    def _resolve_single(self, selection_text, context_text, style_hint=None):
+        with tracing.span("local_parse"):
+            local, remaining, resolved = self._resolve_locally(selection_text, context_text)
+        if remaining is None:
+            return "\n\n".join(local)
+        if local:
+            llm_result = self._resolve_with_llm(remaining, context_text, style_hint, resolved)
+            return "\n\n".join(local + ([llm_result] if llm_result else []))
+        return self._resolve_with_llm(selection_text, context_text, style_hint)
+
+    def _resolve_with_llm(self, selection_text, context_text, style_hint=None, resolved_handles=()):
+        with tracing.span("prompt_build", context_chars=len(context_text or "")):
+            prompt = self._build_resolution_prompt(selection_text, context_text, style_hint, resolved_handles)
+        return self._routed_query(
+            "resolve_citation", prompt,
+            lambda raw: self._is_valid_bibtex(raw, selection_text, resolved_handles),
+        )
+
+    def _build_resolution_prompt(self, selection_text, context_text, style_hint=None, resolved_handles=()):
         style_instruction = ""
         if style_hint and "Unknown" not in style_hint:
              style_instruction = f"NOTE: The document uses '{style_hint}' citation style. STRICTLY enforce this style when identifying handles."
+        resolved_instruction = ""
+        if resolved_handles:
+            resolved_instruction = (
+                f"NOTE: Handles {', '.join(str(h) for h in resolved_handles)} are already resolved. "
+                "Do NOT output BibTeX for them; resolve only the remaining handles."
+            )
 
         prompt = f"""
         You are an expert Research Assistant and BibTeX Resolver.
@@ -127,11 +389,12 @@ class LLMController:
         INPUTS:
         1. User Selection: "{selection_text}"
         2. document_context (Bibliography Section text): 
-        \"\"\"{context_text}\"\"\"
+        \"\"\"{context_text or "(not provided: the selection contains the full reference text)"}\"\"\"
 
         INSTRUCTIONS:
         1. ANALYZE the Selection:
            {style_instruction}
+           {resolved_instruction}
            - Identify ONLY explicit citation handles. Valid formats include:
              - Numeric: "[1]", "[1-3]", "[1, 5]".
              - Author-Year: "(Smith 2020)", "(Doe, 2021)", "(Jones et al. 2022)", "(Wang et al., 2024a)".
@@ -180,4 +443,4 @@ class LLMController:
         # Reuse the helper's connection logic, but we might need to extend LLMHelper.
         # For this file, I'll rely on a new method I'll add to LLMHelper: `custom_query(prompt)`
         
-        return self.llm.custom_query(prompt)
+        return prompt
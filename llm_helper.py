@@ -1,5 +1,13 @@
+import contextvars
 import os
 import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import tracing
 
 # Try importing openai
 try:
@@ -15,18 +23,108 @@ try:
 except ImportError:
     HAS_GENAI = False
 
+class RateLimiter:
+    """
+    Caps concurrent provider calls and, optionally, spaces request starts to
+    stay under a requests-per-minute quota. Shared by all calls of one LLMHelper.
+    """
+
+    def __init__(self, max_concurrent=4, requests_per_minute=None):
+        self.max_concurrent = max_concurrent
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    @contextmanager
+    def slot(self):
+        with tracing.span("rate_limit_wait"):
+            self._slots.acquire()
+            if self.min_interval:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, self._next_start)
+                    self._next_start = start + self.min_interval
+                time.sleep(max(0.0, start - now))
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+
+class HedgePolicy:
+    """
+    Optional tail-latency hedge for LLMHelper calls.
+    If the primary call hasn't answered within the given percentile of its recent
+    latencies, the same prompt is also sent to `secondary` (another LLMHelper,
+    typically a different provider or model). The first valid answer wins.
+    Latencies are tracked per (task, model) key, since full-document range prompts
+    and short style prompts have very different response times.
+    """
+
+    def __init__(self, secondary, percentile=0.95, initial_delay=8.0, min_samples=10, window=200, max_workers=8):
+        self.secondary = secondary
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge")
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "hedges_fired": 0, "hedges_won": 0}
+
+    def delay(self, key=None):
+        """Seconds to wait on the primary before hedging calls of this (task, model) key."""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        idx = min(len(samples) - 1, int(self.percentile * len(samples)))
+        return samples[idx]
+
+    def record_latency(self, seconds, key=None):
+        with self._lock:
+            if key not in self._latencies:
+                self._latencies[key] = deque(maxlen=self.window)
+            self._latencies[key].append(seconds)
+
+    def record(self, fired, won):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["hedges_fired"] += int(fired)
+            self.stats["hedges_won"] += int(won)
+
+    def summary(self):
+        with self._lock:
+            s = dict(self.stats)
+        fired_rate = s["hedges_fired"] / s["requests"] if s["requests"] else 0.0
+        win_rate = s["hedges_won"] / s["hedges_fired"] if s["hedges_fired"] else 0.0
+        return (f"{s['requests']} requests, {s['hedges_fired']} hedges fired ({fired_rate:.0%}), "
+                f"{s['hedges_won']} won ({win_rate:.0%})")
+
+
 class LLMHelper:
     AVAILABLE_MODELS = {
         "openai": ["gpt-4o", "gpt-5.2", "gpt-4-turbo"],
         "gemini": ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-1.0-pro"]
     }
 
+    # Routing ladder per provider, cheapest/fastest first.
+    # LLMController starts each task at a tier and escalates upwards on invalid output.
+    MODEL_TIERS = {
+        "openai": ["gpt-4o", "gpt-5.2"],
+        "gemini": ["gemini-1.5-flash", "gemini-1.5-pro"]
+    }
+
     def __init__(self, api_key=None, provider="auto", model_name=None):
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY") or os.getenv("OPENAI_API_KEY")
         self.is_configured = bool(self.api_key)
         self.provider = provider
         self.client = None
         self.model_name = model_name
+        self._gemini_models = {}
+        self.hedge_policy = None
+        self.rate_limiter = RateLimiter()
         
         if self.is_configured:
             # Auto-detect provider if default
@@ -40,7 +138,7 @@ class LLMHelper:
                 genai.configure(api_key=self.api_key)
                 if not self.model_name:
                     self.model_name = "gemini-1.5-flash"
-                self.model = genai.GenerativeModel(self.model_name)
+                self.model = self._get_gemini_model(self.model_name)
             elif self.provider == "openai" and HAS_OPENAI:
                 if not self.model_name:
                     self.model_name = "gpt-4o"
@@ -50,13 +148,13 @@ class LLMHelper:
         """Updates the active model."""
         self.model_name = model_name
         if self.provider == "gemini" and HAS_GENAI:
-             self.model = genai.GenerativeModel(self.model_name)
+             self.model = self._get_gemini_model(self.model_name)
 
-    def _clean_llm_output(self, text):
-        # Remove markdown code blocks
-        text = re.sub(r'```(?:json|bibtex)?', '', text)
-        text = re.sub(r'```', '', text)
-        return text.strip()
+    def _get_gemini_model(self, model_name):
+        """Returns a cached GenerativeModel so routed calls don't rebuild it every time."""
+        if model_name not in self._gemini_models:
+            self._gemini_models[model_name] = genai.GenerativeModel(model_name)
+        return self._gemini_models[model_name]
 
     def validate_connection(self):
         """
@@ -95,40 +193,107 @@ class LLMHelper:
         except Exception as e:
             return False, f"Connection Failed: {str(e)}"
 
-    def custom_query(self, prompt, json_mode=False, temperature=0):
+    def set_hedge_policy(self, policy):
+        """Enables (HedgePolicy) or disables (None) hedged requests."""
+        self.hedge_policy = policy
+
+    def custom_query(self, prompt, json_mode=False, temperature=0, model_name=None, validator=None, task=None):
         """
         Executes a raw prompt against the configured LLM.
+        model_name overrides the active model for this call only (used for tier routing).
+        validator(raw) -> bool decides which answer wins when hedging is enabled.
+        task names the kind of call so hedging keeps separate latency windows per task.
         """
         if not self.is_configured:
             return None
-        return self._query_llm(prompt, json_mode=json_mode, temperature=temperature)
+        # Covers queueing, hedging and the request itself
+        with tracing.span("provider_call", model=model_name or self.model_name, prompt_chars=len(prompt)):
+            if self.hedge_policy:
+                return self._hedged_query(prompt, json_mode, temperature, model_name, validator or bool, task)
+            return self._query_llm(prompt, json_mode=json_mode, temperature=temperature, model_name=model_name)
+
+    def _hedged_query(self, prompt, json_mode, temperature, model_name, validator, task=None):
+        """
+        Races the primary call against a delayed call to the secondary helper.
+        Returns the first valid answer; the loser is cancelled if it hasn't started,
+        otherwise its result is discarded (provider SDK calls can't be interrupted).
+        """
+        policy = self.hedge_policy
+        key = (task, model_name or self.model_name)
+        start = time.monotonic()
+        # copy_context() carries the active trace ID into the worker threads
+        primary = policy.executor.submit(
+            contextvars.copy_context().run, self._query_llm, prompt, json_mode, temperature, model_name
+        )
+        primary.add_done_callback(lambda _: policy.record_latency(time.monotonic() - start, key))
+
+        pending = {primary}
+        hedge = None
+        delay = policy.delay(key)
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            print(f"[HEDGE] Primary slower than {delay:.1f}s, hedging to {policy.secondary.provider}/{policy.secondary.model_name}")
+            hedge = policy.executor.submit(
+                contextvars.copy_context().run,
+                policy.secondary.custom_query, prompt, json_mode=json_mode, temperature=temperature
+            )
+            pending.add(hedge)
+
+        fallback = None
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if validator(result):
+                    for loser in pending:
+                        loser.cancel()
+                    policy.record(fired=hedge is not None, won=fut is hedge)
+                    return result
+                if fallback is None:
+                    fallback = result
+
+        policy.record(fired=hedge is not None, won=False)
+        if fallback is None and error is not None:
+            raise error
+        # Both sides answered without passing validation (possibly with None)
+        return fallback
 
-    def _query_llm(self, prompt, json_mode=False, temperature=0):
+    def _query_llm(self, prompt, json_mode=False, temperature=0, model_name=None):
         """Helper to handle provider differences"""
+        model_name = model_name or self.model_name
         try:
             if self.provider == "gemini" and HAS_GENAI:
-                response = self.model.generate_content(
-                    prompt,
-                    generation_config={"temperature": temperature},
-                )
+                model = self._get_gemini_model(model_name)
+                with self.rate_limiter.slot(), tracing.span("provider_request", provider=self.provider, model=model_name):
+                    response = model.generate_content(
+                        prompt,
+                        generation_config={"temperature": temperature},
+                    )
                 return self._clean_llm_output(response.text)
             elif self.provider == "openai" and self.client:
                 kwargs = {
-                    "model": self.model_name,
+                    "model": model_name,
                     "messages": [{"role": "user", "content": prompt}],
                     "temperature": temperature,
                 }
                 if json_mode:
                     kwargs["response_format"] = { "type": "json_object" }
                 
-                completion = self.client.chat.completions.create(**kwargs)
+                with self.rate_limiter.slot(), tracing.span("provider_request", provider=self.provider, model=model_name):
+                    completion = self.client.chat.completions.create(**kwargs)
                 return self._clean_llm_output(completion.choices[0].message.content)
         except Exception as e:
             print(f"LLM Query Error: {e}")
             raise e # Propagate error to caller (bib_app.py) for display
             
     def _clean_llm_output(self, text):
-        # Remove markdown code blocks
-        text = re.sub(r'```(?:json|bibtex)?', '', text)
-        text = re.sub(r'```', '', text)
-        return text.strip()
+        with tracing.span("clean_output"):
+            # Remove markdown code blocks
+            text = re.sub(r'```(?:json|bibtex)?', '', text)
+            text = re.sub(r'```', '', text)
+            return text.strip()
@@ -1,49 +1,267 @@
 import fitz  # PyMuPDF
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Tuple
 
+import tracing
+from context_compressor import compress_pages, find_furniture
+
+# Documents with at least this many uncached pages are extracted by a process
+# pool. PyMuPDF keeps the GIL during calls, so threads alone can't extract
+# pages in parallel. One pool is shared by every engine in the process (the
+# server keeps an engine per document) and workers are spawned, not forked,
+# since the GUI and server fork badly with threads running.
+PARALLEL_MIN_PAGES = 32
+EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
+WORKER_OPEN_DOCS = 4
+
+# Page keys that determine its extracted text; annotations (and their links to other pages) don't
+PAGE_TEXT_KEYS = ("Contents", "Resources", "MediaBox", "CropBox", "Rotate")
+OBJECT_REF_RE = re.compile(r"(\d+) \d+ R")
+BACK_REF_RE = re.compile(r"/(?:Parent|P) \d+ \d+ R")
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_docs = OrderedDict()  # per worker process: (path, mtime) -> fitz document
+
+
+def _shared_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _extract_pages_worker(path, mtime, indices):
+    """Runs in a pool worker; keeps a few recently used documents open between tasks."""
+    key = (path, mtime)
+    if key in _worker_docs:
+        _worker_docs.move_to_end(key)
+    else:
+        _worker_docs[key] = fitz.open(path)
+        while len(_worker_docs) > WORKER_OPEN_DOCS:
+            _worker_docs.popitem(last=False)[1].close()
+    doc = _worker_docs[key]
+    return [(i, doc[i].get_text()) for i in indices]
+
+
 class PDFEngine:
-    def __init__(self):
-        self.doc = None
+    """
+    Safe for concurrent use: every thread (Tk rendering, context extraction,
+    indexing) gets its own fitz document handle instead of sharing one.
+    """
+
+    def __init__(self, extract_workers=None):
         self.path = None
+        self.extract_workers = extract_workers if extract_workers is not None else EXTRACT_WORKERS
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._state = None
+        self.last_compression_stats = None
 
     def load_pdf(self, path: str):
-        self.path = path
-        if self.doc:
-            self.doc.close()
-        self.doc = fitz.open(path)
+        doc = fitz.open(path)  # validates the file; becomes this thread's handle
+        with self._lock:
+            old = self._state
+            # Replaced as a whole so in-flight work on the previous document keeps its own snapshot
+            self._state = {
+                "path": path,
+                "generation": (old["generation"] + 1) if old else 1,
+                "page_count": len(doc),
+                "page_texts": {},
+                "furniture": None,
+                "mtime": os.path.getmtime(path),
+            }
+            self.path = path
+        self._local.doc = doc
+        self._local.generation = self._state["generation"]
+        self.last_compression_stats = None
+
+    @property
+    def doc(self):
+        """This thread's handle on the current document (None if nothing is loaded)."""
+        state = self._state
+        return self._handle(state) if state else None
+
+    def _handle(self, state):
+        local = self._local
+        if getattr(local, "generation", None) != state["generation"]:
+            # Stale handles are only ever closed by the thread that owns them
+            if getattr(local, "doc", None) is not None:
+                local.doc.close()
+            local.doc = fitz.open(state["path"])
+            local.generation = state["generation"]
+        return local.doc
+
+    def close(self):
+        with self._lock:
+            self._state = None
+
+    def _page_text(self, state, i: int) -> str:
+        """Raw text of a 0-based page, extracted once per document."""
+        texts = state["page_texts"]
+        if i not in texts:
+            texts[i] = self._handle(state)[i].get_text()
+        return texts[i]
+
+    def get_page_text(self, i: int) -> str:
+        """Raw text of a 0-based page (cached)."""
+        state = self._state
+        return self._page_text(state, i) if state else ""
+
+    def seed_page_texts(self, texts):
+        """Pre-fills the page text cache (e.g. unchanged pages from a previous revision)."""
+        state = self._state
+        if state:
+            state["page_texts"].update(texts)
+
+    def get_page_content_hashes(self):
+        """
+        Per-page change detector that doesn't extract text: hashes each page's content
+        streams together with everything its resources reference (form XObjects,
+        fonts, ...), fully resolved. Pages that draw text through XObjects keep the
+        same content stream when the text changes, so the stream alone isn't enough.
+        """
+        doc = self.doc
+        if not doc:
+            return []
+        memo = {}
+        hashes = []
+        for page in doc:
+            h = hashlib.sha1()
+            for key in PAGE_TEXT_KEYS:
+                kind, value = doc.xref_get_key(page.xref, key)
+                h.update(f"/{key} {kind} ".encode())
+                h.update(self._resolve_refs(doc, value, memo).encode())
+            hashes.append(h.hexdigest())
+        return hashes
+
+    @classmethod
+    def _resolve_refs(cls, doc, text, memo):
+        """Replaces indirect references in PDF object source with digests of what they point to."""
+        return OBJECT_REF_RE.sub(lambda m: cls._object_digest(doc, int(m.group(1)), memo), text)
+
+    @classmethod
+    def _object_digest(cls, doc, xref, memo):
+        """Digest of an object, its stream and (recursively) its references; independent of xref numbering."""
+        if xref in memo:
+            return memo[xref] or "cycle"
+        memo[xref] = None
+        if not 0 < xref < doc.xref_length():
+            memo[xref] = "null"
+            return memo[xref]
+        source = BACK_REF_RE.sub("", doc.xref_object(xref, compressed=True))
+        h = hashlib.sha1(cls._resolve_refs(doc, source, memo).encode())
+        if doc.xref_is_stream(xref):
+            h.update(doc.xref_stream_raw(xref) or b"")
+        memo[xref] = h.hexdigest()
+        return memo[xref]
+
+    def _prefetch_pages(self, state, indices):
+        """Extracts uncached pages, in parallel worker processes for large documents."""
+        missing = [i for i in indices if i not in state["page_texts"]]
+        if len(missing) < PARALLEL_MIN_PAGES or self.extract_workers < 2:
+            return
+        batches = [missing[k::self.extract_workers] for k in range(self.extract_workers)]
+        try:
+            with tracing.span("extract_pages_parallel", pages=len(missing)):
+                futures = [
+                    _shared_pool().submit(_extract_pages_worker, state["path"], state["mtime"], batch)
+                    for batch in batches
+                ]
+                for fut in futures:
+                    state["page_texts"].update(fut.result())
+        except Exception as e:
+            # Fall back to in-thread extraction (e.g. pool unavailable)
+            print(f"[WARN] Parallel page extraction failed: {e}")
+
+    def _join_pages(self, indices, compress=False, drop_captions=False) -> str:
+        state = self._state
+        if not state:
+            return ""
+        indices = list(indices)
+        all_pages = range(state["page_count"])
+        self._prefetch_pages(state, all_pages if compress else indices)
+
+        if not compress:
+            full_text = ""
+            for i in indices:
+                # Header marker for LLM context
+                full_text += f"\n--- Page {i+1} ---\n"
+                full_text += self._page_text(state, i)
+            return full_text
+
+        if state["furniture"] is None:
+            # Headers/footers are detected across the whole document, not just the requested range
+            state["furniture"] = find_furniture([self._page_text(state, i) for i in all_pages])
+        text, stats = compress_pages(
+            [(i + 1, self._page_text(state, i)) for i in indices], state["furniture"], drop_captions
+        )
+        self.last_compression_stats = stats
+        return text
 
     def get_page_count(self):
-        if self.doc:
-            return len(self.doc)
-        return 0
+        state = self._state
+        return state["page_count"] if state else 0
+
+    def get_page_rect(self, page_num: int):
+        doc = self.doc
+        if not doc:
+            return None
+        return doc[page_num].rect
 
     def get_page_pixmap(self, page_num: int, zoom: float = 1.0):
-        if not self.doc:
+        doc = self.doc
+        if not doc:
             return None
-        page = self.doc.load_page(page_num)
+        page = doc.load_page(page_num)
         mat = fitz.Matrix(zoom, zoom)
         pix = page.get_pixmap(matrix=mat)
         return pix
 
     def get_text_in_rect(self, page_num: int, rect: fitz.Rect) -> str:
-        if not self.doc:
+        doc = self.doc
+        if not doc:
             return ""
-        page = self.doc[page_num]
-        return page.get_text("text", clip=rect)
+        with tracing.span("get_text_in_rect", page=page_num + 1):
+            page = doc[page_num]
+            return page.get_text("text", clip=rect)
+
+    def get_text_spans(self, start_page: int, end_page: int):
+        """
+        Span-level text for a 1-based inclusive page range.
+        Returns a list of {"page", "text", "flags", "size"} dicts (flags carry superscript/bold bits).
+        """
+        doc = self.doc
+        if not doc:
+            return []
+        spans = []
+        for i in range(max(0, start_page - 1), min(len(doc), end_page)):
+            for block in doc[i].get_text("dict")["blocks"]:
+                for line in block.get("lines", []):
+                    for span in line["spans"]:
+                        spans.append({"page": i + 1, "text": span["text"], "flags": span["flags"], "size": span["size"]})
+        return spans
 
-    def get_context_text(self, page_count=None, force_full=False) -> str:
+    def get_context_text(self, page_count=None, force_full=False, compress=False, drop_captions=False) -> str:
         """
         Returns the text of the PDF to serve as bibliography context.
         Defaults to FULL DOCUMENT to ensure all references are visible.
         For extremely large documents (>100 pages), might want to smart-limit,
         but for standard papers (30-50 pages), full text is best for the LLM.
+        compress=True strips page furniture (see context_compressor) and records
+        the savings in self.last_compression_stats.
         """
-        if not self.doc: 
+        total_pages = self.get_page_count()
+        if not total_pages:
             return ""
         
-        full_text = ""
-        total_pages = len(self.doc)
-        
         # Heuristic: If requested page_count is None, try to get everything.
         # But if document is huge (> 100 pages), fallback to First 10 + Last 20.
         if page_count is None:
@@ -54,30 +272,20 @@ class PDFEngine:
             start_page = max(0, total_pages - page_count)
             pages_to_read = range(start_page, total_pages)
             
-        for i in pages_to_read:
-            # Header marker for LLM context
-            full_text += f"\n--- Page {i+1} ---\n"
-            full_text += self.doc[i].get_text()
-            
-        return full_text
+        return self._join_pages(pages_to_read, compress=compress, drop_captions=drop_captions)
 
-    def get_context_text_range(self, start_page: int, end_page: int) -> str:
+    def get_context_text_range(self, start_page: int, end_page: int, compress=False) -> str:
         """
         Returns text for a specific 1-based inclusive page range.
         """
-        if not self.doc:
+        total_pages = self.get_page_count()
+        if not total_pages:
             return ""
 
-        total_pages = len(self.doc)
         start_idx = max(0, start_page - 1)
         end_idx = min(total_pages - 1, end_page - 1)
 
         if start_idx > end_idx:
             return ""
 
-        full_text = ""
-        for i in range(start_idx, end_idx + 1):
-            full_text += f"\n--- Page {i+1} ---\n"
-            full_text += self.doc[i].get_text()
-
-        return full_text
+        return self._join_pages(range(start_idx, end_idx + 1), compress=compress)
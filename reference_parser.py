@@ -0,0 +1,261 @@
+import re
+
+# Rule-based parser for the common reference-list formats (APS, IEEE, ACM, APA, Nature).
+# Each parse carries a confidence score; LLMController only skips the LLM for
+# entries above its threshold, so a miss here costs nothing but a regex pass.
+
+DASHES = "-–—‑−"
+
+INITIALS = r"[A-Z][a-z]?\.(?:[\s\-]?[A-Z][a-z]?\.)*"
+SURNAME = r"(?:(?:van|von|de|der|den|da|di|du|le|la|del|dos)\s)*[A-Z][\w'’\-]+(?:\s[A-Z][\w'’\-]+)?"
+FULL_NAME = r"[A-Z][\w'’\-]*\.?(?:\s(?:[A-Z]\.|(?:van|von|de|der|da|di|le|la|del)\b|[A-Z][\w'’\-]+)){1,3}"
+
+AUTHOR_SEP = r"(?:,?\s(?:&|and)\s|,\s)"
+ET_AL = r"(?:,?\set\sal\.?)?"
+
+
+def _author_list(author):
+    return rf"{author}(?:{AUTHOR_SEP}{author})*{ET_AL}"
+
+
+SURNAME_FIRST_LIST = _author_list(rf"{SURNAME},\s{INITIALS}")
+INITIALS_FIRST_LIST = _author_list(rf"{INITIALS}\s?{SURNAME}")
+FULL_NAME_LIST = _author_list(FULL_NAME)
+
+PAGES = rf"[A-Za-z]?\d+(?:\s?[{DASHES}]\s?[A-Za-z]?\d+)?"
+
+STYLE_PATTERNS = {
+    "APA": re.compile(
+        rf"^(?P<authors>{SURNAME_FIRST_LIST})\s\((?P<year>\d{{4}})[a-z]?\)\.\s(?P<title>.+?[.?!])\s"
+        rf"(?P<venue>[^,]+?),\s(?P<volume>\d+)(?:\s?\((?P<number>[^)]+)\))?,\s(?P<pages>{PAGES})\.?(?P<rest>.*)$"
+    ),
+    "Nature": re.compile(
+        rf"^(?P<authors>{SURNAME_FIRST_LIST})\s(?P<title>[^.]+?[.?!])\s(?P<venue>[A-Za-z.\s&]+?)\s"
+        rf"(?P<volume>\d+),\s(?P<pages>{PAGES})\s\((?P<year>\d{{4}})\)\.?(?P<rest>.*)$"
+    ),
+    "IEEE": re.compile(
+        rf"^(?P<authors>{INITIALS_FIRST_LIST}),\s[“\"](?P<title>.+?),?[”\"],?\s(?:in\s)?(?P<venue>[^,]+?),\s(?P<rest>.+)$"
+    ),
+    "APS": re.compile(
+        rf"^(?P<authors>{INITIALS_FIRST_LIST}),\s(?P<venue>[A-Z][A-Za-z.\s&]*?)\s(?P<volume>[A-Z]?\d+),\s"
+        rf"(?P<pages>{PAGES})\s\((?P<year>\d{{4}})\)\.?(?P<rest>.*)$"
+    ),
+    "ACM": re.compile(
+        rf"^(?P<authors>{FULL_NAME_LIST})\.\s(?P<year>\d{{4}})[a-z]?\.\s(?P<title>.+?[.?!])\s(?:In\s)?(?P<rest>.+)$"
+    ),
+}
+
+# Fields each style is expected to provide; confidence is the fraction present.
+REQUIRED_FIELDS = {
+    "APA": ["authors", "title", "venue", "year", "volume", "pages"],
+    "Nature": ["authors", "title", "venue", "year", "volume", "pages"],
+    "IEEE": ["authors", "title", "venue", "year", "pages"],
+    "APS": ["authors", "venue", "year", "volume", "pages"],  # APS omits titles
+    "ACM": ["authors", "title", "venue", "year", "pages"],
+}
+
+DOI_RE = re.compile(r"\b(10\.\d{4,9}/[^\s,;]+)")
+URL_RE = re.compile(r"(?:https?://|www\.)\S+")
+ET_AL_RE = re.compile(r",?\set\sal\.?$")
+YEAR_RE = re.compile(r"\b((?:19|20)\d{2})[a-z]?\b")
+LABEL_RE = re.compile(r"^\s*(?:\[(\d{1,4})\]|(\d{1,4})\.(?=\s)|(\d{1,4})\s(?=[A-Z]))\s*")
+SURNAME_FIRST_START_RE = re.compile(rf"^{SURNAME},\s{INITIALS}")
+PAGE_MARKER_RE = re.compile(r"^\s*--- Page \d+ ---\s*$")
+
+
+def normalize_reference_text(text):
+    """Joins wrapped lines (undoing line-break hyphenation) and collapses whitespace."""
+    out = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if out.endswith("-") and line[:1].islower():
+            out = out[:-1] + line
+        elif out.endswith(tuple(DASHES)) or not out:
+            out += line
+        else:
+            out += " " + line
+    return re.sub(r"\s+", " ", out).strip()
+
+
+def split_entries(text):
+    """
+    Splits bibliography text into entries.
+    Returns a list of {"label": int or None, "text": str, "raw": str}; raw keeps the
+    entry's original lines, label included. Labelled lists ([1], 1.)
+    are split on sequential labels only, so stray page numbers don't start entries;
+    a "[1]" or "1." restarts the sequence, so a numbered heading before the list
+    (e.g. "5 Conclusions") doesn't hide it. Unlabelled lists (APA/Nature) split on
+    surname-first lines after a full stop.
+    """
+    # Bare numbers on their own line are page numbers, and "--- Page N ---" markers
+    # come from PDFEngine context text; neither is reference text
+    lines = [
+        l for l in text.splitlines()
+        if l.strip() and not l.strip().isdigit() and not PAGE_MARKER_RE.match(l)
+    ]
+    entries = []
+    next_label = None
+    for line in lines:
+        m = LABEL_RE.match(line)
+        label = int(next(g for g in m.groups() if g)) if m else None
+        restarts = label == 1 and bool(m.group(1) or m.group(2))
+        if label is not None and (next_label is None or label == next_label or restarts):
+            entries.append({"label": label, "lines": [line[m.end():]], "raw": [line]})
+            next_label = label + 1
+        elif (next_label is None and entries and SURNAME_FIRST_START_RE.match(line.strip())
+              and entries[-1]["lines"][-1].rstrip().endswith(".")):
+            entries.append({"label": None, "lines": [line], "raw": [line]})
+        elif entries:
+            entries[-1]["lines"].append(line)
+            entries[-1]["raw"].append(line)
+        else:
+            entries.append({"label": None, "lines": [line], "raw": [line]})
+
+    return [
+        {"label": e["label"], "text": normalize_reference_text("\n".join(e["lines"])), "raw": "\n".join(e["raw"])}
+        for e in entries
+    ]
+
+
+def index_entries(text):
+    """Maps numeric labels to entry text for a labelled bibliography."""
+    return {e["label"]: e["text"] for e in split_entries(text) if e["label"] is not None}
+
+
+def _split_authors(authors, surname_first):
+    """Returns "Surname, Given" names; a trailing "et al." becomes BibTeX's "others"."""
+    authors = authors.strip()
+    et_al = bool(ET_AL_RE.search(authors))
+    authors = ET_AL_RE.sub("", authors)
+    names = _split_names(authors, surname_first)
+    return names + ["others"] if et_al else names
+
+
+def _split_names(authors, surname_first):
+    if surname_first:
+        # "Smith, J. A., Doe, B. & Lee, C." -> pairs of (surname, initials)
+        parts = re.findall(rf"({SURNAME}),\s({INITIALS})", authors)
+        return [f"{surname}, {initials}" for surname, initials in parts]
+    names = [n.strip() for n in re.split(r",?\s(?:&|and)\s|,\s", authors) if n.strip()]
+    result = []
+    for name in names:
+        m = re.match(rf"^({INITIALS})\s?(.+)$", name)
+        if m:
+            result.append(f"{m.group(2)}, {m.group(1)}")
+        else:
+            given, _, surname = name.rpartition(" ")
+            result.append(f"{surname}, {given}" if given else surname)
+    return result
+
+
+def _fields_from_rest(rest):
+    """Pulls volume/number/pages/year out of an IEEE- or ACM-style tail."""
+    fields = {}
+    m = re.search(r"\bvol\.\s?(\w+)", rest) or re.search(r"(?:^|\s)(\d+),\s\d+\s\(", rest)
+    if m:
+        fields["volume"] = m.group(1)
+    m = re.search(r"\bno\.\s?(\w+)", rest) or re.search(r"\d+,\s(\d+)\s\(", rest)
+    if m:
+        fields["number"] = m.group(1)
+    m = re.search(rf"\bpp?\.\s?({PAGES})", rest) or re.search(rf"(?:^|[\s,])(\d+\s?[{DASHES}]\s?\d+)\.", rest)
+    if m:
+        fields["pages"] = m.group(1)
+    years = YEAR_RE.findall(rest)
+    if years:
+        fields["year"] = years[-1]
+    return fields
+
+
+def _unparsed_tail(rest, style):
+    """
+    Text the pattern matched but didn't parse. For APA/Nature/APS the tail should hold
+    at most a DOI or URL; anything else (e.g. "; B. Jones, ..." in a combined APS
+    reference) means the parse is incomplete. IEEE/ACM tails are parsed, so only a
+    second reference joined by ";" counts there.
+    """
+    if style in ("IEEE", "ACM"):
+        return ";" if ";" in rest else ""
+    tail = URL_RE.sub("", DOI_RE.sub("", rest))
+    tail = re.sub(r"\b(?:doi|DOI|URL)\b:?", "", tail)
+    return re.sub(r"[\s.,:]+", "", tail)
+
+
+def _acm_venue(rest):
+    """ACM tails look like 'Commun. ACM 62, 3 (2019), 45–52.' or 'Proc. of X (CHI '19). ACM, 1–12.'"""
+    m = re.match(r"^(.+?)\s\d+,\s\d+\s\(", rest)
+    if m:
+        return m.group(1)
+    return rest.split(". ")[0].split(", ")[0].rstrip(".")
+
+
+def parse_reference(text):
+    """
+    Parses one reference string.
+    Returns a dict with authors (list), title, venue, volume, number, pages, year,
+    doi, style and confidence (0.0-1.0). Unrecognised text gets confidence 0.
+    """
+    text = normalize_reference_text(LABEL_RE.sub("", text, count=1))
+    best = {"style": None, "confidence": 0.0, "raw": text}
+
+    for style, pattern in STYLE_PATTERNS.items():
+        m = pattern.match(text)
+        if not m:
+            continue
+        fields = {k: v for k, v in m.groupdict().items() if v}
+        rest = fields.pop("rest", "")
+        if style in ("IEEE", "ACM"):
+            fields = {**_fields_from_rest(rest), **fields}
+        if style == "ACM":
+            fields["venue"] = _acm_venue(rest)
+
+        fields["authors"] = _split_authors(fields.get("authors", ""), surname_first=style in ("APA", "Nature"))
+        if "title" in fields:
+            fields["title"] = fields["title"].strip().rstrip(".,")
+        if "venue" in fields:
+            fields["venue"] = fields["venue"].strip().rstrip(",")
+        if "pages" in fields:
+            fields["pages"] = re.sub(rf"\s?[{DASHES}]\s?", "--", fields["pages"])
+        doi = DOI_RE.search(text)
+        if doi:
+            fields["doi"] = doi.group(1).rstrip(".")
+
+        required = REQUIRED_FIELDS[style]
+        present = sum(1 for f in required if fields.get(f))
+        confidence = present / len(required)
+        if style != "APS" and len(fields.get("title", "")) < 8:
+            confidence *= 0.5
+        if _unparsed_tail(rest, style):
+            confidence *= 0.5
+        if confidence > best["confidence"]:
+            best = {**fields, "style": style, "confidence": round(confidence, 2), "raw": text}
+
+    return best
+
+
+def _citation_key(parsed):
+    first = parsed["authors"][0] if parsed.get("authors") else "ref"
+    surname = re.sub(r"[^a-z]", "", first.split(",")[0].lower()) or "ref"
+    word = next((w for w in re.findall(r"[A-Za-z]+", parsed.get("title", "")) if len(w) > 3), "")
+    return f"{surname}{parsed.get('year', '')}{word.lower()}"
+
+
+def to_bibtex(parsed):
+    """Formats a parse_reference() result as a BibTeX entry."""
+    venue = parsed.get("venue", "")
+    # No \b after "Proc.": there is no word boundary between "." and a space
+    is_proceedings = bool(re.search(r"\b(?:Proc\.(?=\s|$)|(?:Proceedings|Conference|Workshop|Symposium)\b)", venue))
+    entry_type = "inproceedings" if is_proceedings else "article"
+    fields = [
+        ("author", " and ".join(parsed.get("authors", []))),
+        ("title", parsed.get("title")),
+        ("booktitle" if is_proceedings else "journal", venue),
+        ("volume", parsed.get("volume")),
+        ("number", parsed.get("number")),
+        ("pages", parsed.get("pages")),
+        ("year", parsed.get("year")),
+        ("doi", parsed.get("doi")),
+    ]
+    body = ",\n".join(f"  {name} = {{{value}}}" for name, value in fields if value)
+    return f"@{entry_type}{{{_citation_key(parsed)},\n{body}\n}}"
@@ -0,0 +1,119 @@
+import math
+import re
+from collections import Counter, defaultdict
+
+# Local BM25 retrieval over paragraph/footnote-sized chunks of the document.
+# Used when no clean bibliography section was found (e.g. footnote-style law
+# and humanities papers): instead of sending the full text with every
+# selection, only the top-k candidate reference snippets go to the LLM.
+
+PAGE_MARKER_RE = re.compile(r"^--- Page (\d+) ---$", re.MULTILINE)
+# A new chunk starts at a footnote/reference label: "12 Smith, ...", "[3] ...", "4. ..."
+CHUNK_START_RE = re.compile(r"^(?:\[(\d{1,4})\]|(\d{1,4})\.?)\s+(?=[A-Z“\"'(])")
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+YEAR_RE = re.compile(r"\b(1[5-9]\d{2}|20\d{2})[a-z]?\b")
+
+MAX_CHUNK_CHARS = 600
+
+STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "are", "was", "were", "has", "have",
+    "not", "but", "its", "their", "which", "been", "also", "into", "than", "see", "supra",
+    "infra", "ibid", "id", "et", "al", "pp", "vol", "no", "in", "of", "on", "to", "a", "an",
+}
+
+
+def tokenize(text):
+    return [t for t in (m.lower() for m in TOKEN_RE.findall(text)) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def chunk_pages(pages):
+    """
+    Splits (page_number, text) pages into paragraph/footnote-sized chunks.
+    Returns a list of {"page": int, "label": int or None, "text": str}.
+    """
+    chunks = []
+    for page_num, text in pages:
+        current = None
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            m = CHUNK_START_RE.match(line)
+            starts_new = (
+                current is None
+                or m is not None
+                or (len(current["text"]) > MAX_CHUNK_CHARS and current["text"].endswith("."))
+            )
+            if starts_new:
+                label = int(m.group(1) or m.group(2)) if m else None
+                current = {"page": page_num, "label": label, "text": line}
+                chunks.append(current)
+            else:
+                current["text"] += " " + line
+    return chunks
+
+
+def split_context_pages(context_text):
+    """Parses "--- Page N ---" marked text back into (page_number, text) pairs."""
+    parts = PAGE_MARKER_RE.split(context_text)
+    return [(int(parts[i]), parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(list)  # term -> [(chunk_idx, tf)]
+        self._lengths = []
+        for idx, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk["text"]))
+            self._lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self._postings[term].append((idx, tf))
+        self._avg_len = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        self._labels = defaultdict(list)
+        for idx, chunk in enumerate(chunks):
+            if chunk["label"] is not None:
+                self._labels[chunk["label"]].append(idx)
+
+    @classmethod
+    def from_context_text(cls, context_text):
+        return cls(chunk_pages(split_context_pages(context_text)))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _idf(self, term):
+        n = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self.chunks) - n + 0.5) / (n + 0.5))
+
+    def search(self, query_terms, k=8, label_boosts=()):
+        """Returns the top-k chunk indices for the query terms."""
+        scores = defaultdict(float)
+        for term in set(query_terms):
+            idf = self._idf(term)
+            for idx, tf in self._postings.get(term, ()):
+                norm = 1 - self.b + self.b * self._lengths[idx] / self._avg_len
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        # Footnote/reference numbers in the selection point straight at labelled chunks
+        for label in label_boosts:
+            for idx in self._labels.get(label, ()):
+                scores[idx] += 10.0
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+    def _query(self, selection_text, k):
+        names = [w for w in re.findall(r"\b[A-Z][\w'’\-]+", selection_text) if w.lower() not in STOPWORDS]
+        years = YEAR_RE.findall(selection_text)
+        # Footnote markers sit next to sentence punctuation ("held.12", "note 14."); skip decimals like 3.5
+        numbers = {int(n) for n in re.findall(r"(?<!\d)(?<!\d\.)(\d{1,3})(?!\d)(?!\.\d)", selection_text)}
+        return self.search(tokenize(" ".join(names)) + years, k=k, label_boosts=numbers)
+
+    def retrieve(self, selection_text, k=8):
+        """Top-k candidate reference chunks for a selection (author names, years, footnote numbers)."""
+        return [self.chunks[i] for i in self._query(selection_text, k)]
+
+    def build_context(self, selection_text, k=8):
+        """Formats retrieved chunks, in document order, as page-marked context text ("" if nothing matched)."""
+        hits = sorted(self._query(selection_text, k))
+        return "".join(f"\n--- Page {self.chunks[i]['page']} ---\n{self.chunks[i]['text']}\n" for i in hits)
@@ -0,0 +1,73 @@
+import re
+from collections import Counter
+
+# Local citation-style classifier. Counts handle patterns in the main body
+# (after the abstract), superscript spans and footnote lines, and returns one
+# of the labels LLMController.detect_citation_style produces plus a confidence.
+
+NUMERIC_RE = re.compile(r"\[\d{1,4}(?:\s*[,;\-–—]\s*\d{1,4})*\]")
+ALPHA_RE = re.compile(r"\[[A-Z][A-Za-z+]{1,4}\s?\d{2}[a-z]?(?:\s*[,;]\s*[A-Z][A-Za-z+]{1,4}\s?\d{2}[a-z]?)*\]")
+AUTHOR_YEAR_RE = re.compile(
+    r"\(\s*(?:see\s|e\.g\.,?\s)?[A-Z][\w'’\-]+(?:\set\sal\.|\s(?:and|&)\s[A-Z][\w'’\-]+)?,?\s(?:19|20)\d{2}[a-z]?"
+    r"|[A-Z][\w'’\-]+(?:\set\sal\.|\s(?:and|&)\s[A-Z][\w'’\-]+)?\s\((?:19|20)\d{2}[a-z]?\)"
+)
+FOOTNOTE_LINE_RE = re.compile(
+    r"^\d{1,3}\s+(?:See\b|Id\.|Ibid|Cf\.|[A-Z][\w'’\-]+,\s).*?(?:\b(?:19|20)\d{2}\b|supra|note\s\d+|at\s\d+)"
+)
+SUPERSCRIPT_RE = re.compile(r"^\d{1,3}(?:\s*[,\-–]\s*\d{1,3})*$")
+BODY_START_RE = re.compile(r"^\s*(?:(?:1|I)\.?\s+)?(?:Introduction|INTRODUCTION|Background|BACKGROUND)\s*$", re.MULTILINE)
+
+SUPERSCRIPT_FLAG = 1  # PyMuPDF span flag bit for superscript text
+
+# Handles needed before the classifier trusts a label
+MIN_EVIDENCE = 5
+
+
+def main_body(text):
+    """Drops title/abstract matter: returns text from the Introduction heading onward if found."""
+    m = BODY_START_RE.search(text)
+    return text[m.start():] if m else text
+
+
+def count_superscript_handles(spans):
+    """
+    Counts numeric superscript spans (e.g. "word^12") from span-level extraction,
+    skipping affiliation markers before the Introduction heading when there is one.
+    """
+    start = next((i for i, s in enumerate(spans) if BODY_START_RE.match(s["text"])), 0)
+    return sum(
+        1 for s in spans[start:]
+        if s["flags"] & SUPERSCRIPT_FLAG and SUPERSCRIPT_RE.match(s["text"].strip())
+    )
+
+
+def classify_citation_style(text, spans=None):
+    """
+    Returns (label, confidence). label is one of "Numeric Brackets", "Author-Year",
+    "Superscript", "Alpha-Numeric", "Footnotes" or "Unknown/Generic".
+    spans: optional list of {"text", "flags"} dicts; needed to see superscripts.
+    """
+    body = main_body(text)
+    counts = Counter({
+        "Numeric Brackets": len(NUMERIC_RE.findall(body)),
+        "Alpha-Numeric": len(ALPHA_RE.findall(body)),
+        "Author-Year": len(AUTHOR_YEAR_RE.findall(body)),
+    })
+    superscripts = count_superscript_handles(spans) if spans else 0
+    footnote_lines = sum(1 for line in body.splitlines() if FOOTNOTE_LINE_RE.match(line.strip()))
+    if superscripts:
+        # Superscripts that point to citation-like footnotes are footnote citations
+        if footnote_lines >= max(3, superscripts // 3):
+            counts["Footnotes"] = superscripts
+        else:
+            counts["Superscript"] = superscripts
+    elif footnote_lines >= MIN_EVIDENCE:
+        counts["Footnotes"] = footnote_lines
+
+    total = sum(counts.values())
+    if not total:
+        return "Unknown/Generic", 0.0
+    label, top = counts.most_common(1)[0]
+    share = top / total
+    evidence = min(1.0, top / MIN_EVIDENCE)
+    return label, round(share * evidence, 2)
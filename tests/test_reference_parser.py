@@ -0,0 +1,73 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reference_parser import index_entries, parse_reference, split_entries, to_bibtex
+
+
+APS_1 = "[1] A. Smith, Phys. Rev. B 99, 123456 (2019)."
+APS_2 = "[2] B. Jones and C. Lee, Phys. Rev. Lett. 120, 101101 (2018)."
+APS_3 = "[3] D. Kim, Phys. Rev. A 101, 012345 (2020)."
+
+
+def test_split_entries_sequential_labels():
+    entries = split_entries("\n".join([APS_1, APS_2, APS_3]))
+    assert [e["label"] for e in entries] == [1, 2, 3]
+    assert entries[1]["text"].startswith("B. Jones and C. Lee")
+    assert entries[1]["raw"] == APS_2
+
+
+def test_split_entries_ignores_stray_numbers_inside_entries():
+    text = "1. A. Smith, Phys. Rev. B 99,\n7 Stray line\n123456 (2019).\n2. B. Jones, Phys. Rev. A 1, 2 (2000)."
+    entries = split_entries(text)
+    assert [e["label"] for e in entries] == [1, 2]
+    assert "Stray line" in entries[0]["text"]
+
+
+def test_numbered_heading_before_list_restarts_sequence():
+    ctx = "\n".join(["--- Page 9 ---", "5 Conclusions", "We conclude.", "References", APS_1, APS_2])
+    indexed = index_entries(ctx)
+    assert indexed[1].startswith("A. Smith")
+    assert indexed[2].startswith("B. Jones")
+
+
+def test_page_markers_are_not_glued_to_entries():
+    ctx = "\n".join(["--- Page 9 ---", APS_1, APS_2, "--- Page 10 ---", APS_3])
+    indexed = index_entries(ctx)
+    assert "Page" not in indexed[2]
+    assert parse_reference(indexed[2])["confidence"] == 1.0
+    assert parse_reference(indexed[3])["confidence"] == 1.0
+
+
+def test_et_al_becomes_others():
+    parsed = parse_reference("Smith, J. et al. Deep learning for cats. Nature 521, 436–444 (2015).")
+    assert parsed["style"] == "Nature"
+    assert parsed["authors"] == ["Smith, J.", "others"]
+
+
+def test_combined_reference_is_not_confident():
+    parsed = parse_reference("A. Smith, Phys. Rev. B 99, 123456 (2019); B. Jones, Phys. Rev. A 1, 2 (2000).")
+    assert parsed["confidence"] < 0.9
+
+
+def test_doi_tail_keeps_confidence():
+    parsed = parse_reference("A. Smith, Phys. Rev. B 99, 123456 (2019), doi:10.1103/PhysRevB.99.123456.")
+    assert parsed["confidence"] == 1.0
+    assert parsed["doi"] == "10.1103/PhysRevB.99.123456"
+
+
+def test_ieee_conference_is_inproceedings():
+    parsed = parse_reference(
+        'A. Krizhevsky, I. Sutskever, and G. Hinton, "ImageNet classification with deep convolutional '
+        'neural networks," in Proc. Adv. Neural Inf. Process. Syst., 2012, pp. 1097–1105.'
+    )
+    bibtex = to_bibtex(parsed)
+    assert bibtex.startswith("@inproceedings{")
+    assert "booktitle = {Proc. Adv. Neural Inf. Process. Syst.}" in bibtex
+
+
+def test_journal_is_article():
+    bibtex = to_bibtex(parse_reference("A. Smith, Phys. Rev. B 99, 123456 (2019)."))
+    assert bibtex.startswith("@article{")
+    assert "journal = {Phys. Rev. B}" in bibtex
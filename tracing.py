@@ -0,0 +1,132 @@
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Opt-in per-request tracing for the selection path.
+#   BIB_TRACE_DIR=/tmp/traces        -> one Chrome trace-event JSON per request
+#                                       (open in chrome://tracing or ui.perfetto.dev)
+#   BIB_PROFILE_STAGE=provider_call  -> also wrap that span in cProfile and dump .prof stats
+# When BIB_TRACE_DIR is unset every call here is a cheap no-op.
+
+_config = {
+    "trace_dir": os.getenv("BIB_TRACE_DIR"),
+    "profile_stage": os.getenv("BIB_PROFILE_STAGE"),
+}
+_current_trace = contextvars.ContextVar("bib_trace_id", default=None)
+_events = {}
+_profile_counts = {}  # trace_id -> profiles dumped so far (a stage can run several times per trace)
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def configure(trace_dir=None, profile_stage=None):
+    """Enables tracing programmatically (overrides the environment variables)."""
+    _config["trace_dir"] = trace_dir
+    _config["profile_stage"] = profile_stage
+
+
+def enabled():
+    return bool(_config["trace_dir"])
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+def start_trace(name):
+    """Opens a new trace and returns its ID (None when tracing is disabled)."""
+    if not enabled():
+        return None
+    trace_id = uuid.uuid4().hex[:12]
+    with _lock:
+        _events[trace_id] = [{
+            "name": name, "ph": "i", "s": "p", "ts": _now_us(),
+            "pid": _pid, "tid": threading.get_ident(), "args": {"trace_id": trace_id},
+        }]
+    return trace_id
+
+
+def current_trace_id():
+    return _current_trace.get()
+
+
+@contextmanager
+def activate(trace_id):
+    """Makes trace_id current for spans in this thread/context."""
+    token = _current_trace.set(trace_id)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name, trace_id=None, **args):
+    """Records a complete ("X") event for the enclosed block under the current trace."""
+    trace_id = trace_id or _current_trace.get()
+    if not enabled() or trace_id is None:
+        yield
+        return
+
+    profiler = None
+    if _config["profile_stage"] == name:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active (e.g. concurrent request in the same stage)
+            profiler = None
+
+    start = _now_us()
+    try:
+        yield
+    finally:
+        duration = _now_us() - start
+        if profiler:
+            profiler.disable()
+            _dump_profile(profiler, name, trace_id)
+        event = {
+            "name": name, "ph": "X", "ts": start, "dur": duration,
+            "pid": _pid, "tid": threading.get_ident(),
+            "args": {"trace_id": trace_id, **{k: str(v) for k, v in args.items()}},
+        }
+        with _lock:
+            if trace_id in _events:
+                _events[trace_id].append(event)
+
+
+def end_trace(trace_id):
+    """Writes the trace as Chrome trace-event JSON and returns the file path."""
+    if not enabled() or trace_id is None:
+        return None
+    with _lock:
+        events = _events.pop(trace_id, None)
+        _profile_counts.pop(trace_id, None)
+    if not events:
+        return None
+    os.makedirs(_config["trace_dir"], exist_ok=True)
+    path = os.path.join(_config["trace_dir"], f"trace-{trace_id}.json")
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    total_ms = (max(e["ts"] + e.get("dur", 0) for e in events) - events[0]["ts"]) / 1000
+    print(f"[TRACE] {trace_id}: {total_ms:.0f} ms -> {path}")
+    return path
+
+
+def _dump_profile(profiler, stage, trace_id):
+    with _lock:
+        seq = _profile_counts.get(trace_id, 0) + 1
+        _profile_counts[trace_id] = seq
+    os.makedirs(_config["trace_dir"], exist_ok=True)
+    path = os.path.join(_config["trace_dir"], f"profile-{stage}-{trace_id}-{seq}.prof")
+    profiler.dump_stats(path)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(15)
+    print(f"[PROFILE] {stage} ({trace_id} #{seq}) -> {path}\n{out.getvalue()}")